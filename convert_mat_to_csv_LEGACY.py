@@ -21,203 +21,204 @@ Transportation Systems (IEEE), 2017.
 """
 
 from scipy.io import loadmat
-from os import listdir
-from os.path import isfile, join
+from os import cpu_count
+from os.path import basename
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+import numpy as np
+from numba import njit
+
+from smd_gt_utils import generate_gt_files_dict
 
 # set the paths to the ground truth .mat files
 PATHS_TO_GT_FILES = ["NIR/ObjectGT", "VIS_Onshore/ObjectGT", "VIS_Onboard/ObjectGT"]
 # set the path and filesnames where the txt files will be saved in CSV format
 PATHS_TO_SAVE_CSV_FILES = ['objects_nir.txt', 'objects_onshore.txt', 'objects_onboard.txt']
 
-class Frame:
-    """
-    This is a class to save the data for each video frame
-    """
-    csv_list = []
-    csv_list_initialized = False
-    
-    def __init__(self, frame, image_name, bb, objects, motion, distance):
-        """
-        Parameters
-        ----------
-            frame : the frame number of the video. (string or int)
-            image_name : the name of the image (for identification). (string)
-            bb : bounding box coordinates of the objects. This is an array. 
-                Each line is the bb of an object and corresponds to 
-                [x_min,y_min,width,height]. See the dataset webpage for more
-                info.
-            objects : the type of objects. (array)
-            motion : of the objects are moving or not. (array)
-            distance : distance of each objects. (array)
-            
-        """
-        self.frame = frame
-        self.image_name = image_name
-        self.bb = bb
-        self.objects = objects
-        self.motion = motion
-        self.distance = distance
-        self.csv_list_initialized = False
-        
-    def generate_list_as_csv(self, integer_bb=False):
-        """
-        Tranform the frame data into a list of cvs entries. Each entry is of
-        the form:
-            
-            [<video_name>_<frame_number>, 
-            x_min, 
-            y_min, 
-            object width, 
-            object height, 
-            type of object, 
-            distance of object, 
-            type of motion of object]
-        
-        Parameters
-        ----------
-        integer_bb : should the bounding box coordinates be integers? (boolean)
-                        Default is False.
-        """
-        self.csv_list = []
-        number_of_objects = len(self.objects) # get the total number of objects
-        
-        # objects is a list in a list. To avoid problems with " len([[]]) -> 1 " that sanity chack should be used.
-        if len(self.objects[0]) > 0:
-            for i in range(number_of_objects):
-                # avoid possible bad entries / there is one in MVI_1613_VIS_frame0.jpg
-                if (int(self.objects[i][0])) != 0:
-                    if integer_bb:
-                        entry = self.image_name + ',' \
-                                    + str(int(self.bb[i,0])) + ',' \
-                                    + str(int(self.bb[i,1])) + ',' \
-                                    + str(int(self.bb[i,2])) + ',' \
-                                    + str(int(self.bb[i,3])) + ',' \
-                                    + str(self.objects[i][0]) + ',' \
-                                    + str(self.distance[i][0]) + ',' \
-                                    + str(self.motion[i][0])
-                    else:
-                        entry = self.image_name + ',' \
-                                    + str(self.bb[i,0]) + ',' \
-                                    + str(self.bb[i,1]) + ',' \
-                                    + str(self.bb[i,2]) + ',' \
-                                    + str(self.bb[i,3]) + ',' \
-                                    + str(self.objects[i][0]) + ',' \
-                                    + str(self.distance[i][0]) + ',' \
-                                    + str(self.motion[i][0])
-                    self.csv_list.append(entry)
-            
-        self.csv_list_initialized = True
-            
-    def get_list_as_csv(self):
-        if not self.csv_list_initialized:
-            self.generate_list_as_csv() # create list with float bb
-        return self.csv_list
-    
-def generate_gt_files_dict(path_to_gt_files):
+
+@njit(cache=True)
+def _filter_and_cast(bb, obj_codes):
     """
-    Creates a dictionary with all the ground truth files location.
-    
+    Jit compiled kernel for the bad entry filter and the integer cast of the
+    bounding boxes.
+
     Parameters
     ----------
-    path_to_gt_files : the path to the ground truth files. (string)
-    
+    bb : the bounding box coordinates of all the objects. (2D float array)
+    obj_codes : the integer type codes of all the objects. (1D int array)
+
     Returns
     -------
-    object_gt_files_dict : dictionary in the form:
-        (key:value) -> (<video_name>:<video_path>)
+    mask : boolean array which is True for the valid (non zero) objects.
+    bb_int : the bounding box coordinates cast to integers. (2D int array)
     """
-    object_gt_files_dict = {}
-    for f in listdir(path_to_gt_files):
-        if isfile(join(path_to_gt_files, f)):
-            object_gt_files_dict[f.split('.')[0].replace('_ObjectGT','')] = join(path_to_gt_files, f)
-        
-    return object_gt_files_dict
-    
+    number_of_objects = bb.shape[0]
+    mask = np.empty(number_of_objects, dtype=np.bool_)
+    bb_int = np.empty(bb.shape, dtype=np.int64)
+    for i in range(number_of_objects):
+        mask[i] = obj_codes[i] != 0
+        bb_int[i, 0] = int(bb[i, 0])
+        bb_int[i, 1] = int(bb[i, 1])
+        bb_int[i, 2] = int(bb[i, 2])
+        bb_int[i, 3] = int(bb[i, 3])
+    return mask, bb_int
+
+# warm the jit cache once at import time so the compiled kernel is reused
+_filter_and_cast(np.zeros((1, 4)), np.zeros(1, dtype=np.int64))
 
-def load_mat_files_in_dict(path):
+
+def iter_mat_files_columns(path):
     """
-    Loads all the .mat files of the Singapore Maritime Dataset. It converts
-    each frame of the .mat files into a Frame class instance and then adds it
-    into a dictionary called "frames".
-    
+    Loads all the .mat files of the Singapore Maritime Dataset one file at a
+    time. The data of the frames of each file are stacked directly into
+    column arrays with one entry per object (structure of arrays) instead of
+    one Python object per frame.
+
     Parameters
     ----------
     path : the path where the .mat files are located. (string)
-    
-    Returns
-    -------
-    frames : a dictionary of the form:
-            (key:value) -> (<video_name>_<frame_number>:<Frame class instance>)
+
+    Yields
+    ------
+    columns : one dictionary per .mat file of column arrays with the keys:
+            'image_name', 'bb', 'objects', 'distance', 'motion'
+        'bb' is a 2D array where each line is the bb of an object and
+        corresponds to [x_min,y_min,width,height]. All the other columns
+        have one entry per object.
     """
-    frames = {}
     object_gt_files_dict = generate_gt_files_dict(path)
+    file_names = list(object_gt_files_dict.values())
+
+    # loadmat spends most of its time in C code (decompression and array
+    # allocation) with the GIL released, so the .mat files are parsed by a
+    # thread pool while the results are consumed in order
+    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+        for file_name, gt in zip(file_names,
+                                 executor.map(loadmat, file_names)):
+            struct_xml = gt['structXML'][0]
+
+            # get the number of frames
+            frames_number = len(struct_xml)
+
+            # hoist the field arrays of the structured array once per file
+            # instead of resolving them again for every frame
+            bbs = struct_xml['BB']
+            objs = struct_xml['Object']
+            dists = struct_xml['Distance']
+            mots = struct_xml['Motion']
+
+            # build all the frame names of the video at once with vectorized
+            # numpy string ops instead of formatting one name per frame
+            video_prefix = basename(file_name).replace('_ObjectGT.mat','') + '_frame'
+            frame_names = np.char.add(
+                    np.char.add(video_prefix,
+                                np.arange(frames_number).astype(str)),
+                    '.jpg')
+
+            counts = np.zeros(frames_number, dtype=np.int64)
+            bb_parts = []
+            obj_parts = []
+            dist_parts = []
+            mot_parts = []
+
+            # process data for each frame
+            for i in range(frames_number):
+                objects = objs[i]
+
+                # objects is a list in a list. To avoid problems with " len([[]]) -> 1 " that sanity chack should be used.
+                if len(objects[0]) == 0:
+                    continue
+
+                counts[i] = len(objects)
+                bb_parts.append(bbs[i])
+                obj_parts.append(objects[:,0])
+                dist_parts.append(dists[i][:,0])
+                mot_parts.append(mots[i][:,0])
+
+            if not bb_parts:
+                continue
+
+            # repeat each frame name once per object it contains
+            image_names = np.repeat(frame_names, counts)
+
+            yield {'image_name': image_names,
+                   'bb': np.concatenate(bb_parts),
+                   'objects': np.concatenate(obj_parts),
+                   'distance': np.concatenate(dist_parts),
+                   'motion': np.concatenate(mot_parts)}
     
-    for key in object_gt_files_dict.keys():
-        file_name = object_gt_files_dict[key]
-        
-        gt = loadmat(file_name)
-        
-        # get the number of frames
-        frames_number = len(gt['structXML'][0])
-        
-        # process data for each frame
-        for i in range(frames_number):
-            image_name = file_name.split('/')[-1].replace('_ObjectGT.mat','') + ('_frame%d.jpg' % i)
-            bb = gt['structXML'][0]['BB'][i]
-            objects = gt['structXML'][0]['Object'][i]                
-            motion = gt['structXML'][0]['Motion'][i]
-            distance = gt['structXML'][0]['Distance'][i]
-            frame = Frame(i, image_name, bb, objects, motion, distance)
-            frames[image_name] = frame
-        
-    return frames
-    
-def get_all_gt_files_in_csv(path, integer_bb=False):
+def get_all_gt_files_in_csv(path, save_path, integer_bb=False):
     """
-    Create a list with ALL frames object instance in csv format. Each frame has
-    multiple objects. With this function we split each object as a separate
-    entry as a csv value in a list.
-    
+    Save ALL frames object instances of a dataset in a csv file. Each frame
+    has multiple objects. With this function we split each object as a
+    separate entry (line) in the csv file. Each entry is of the form:
+
+            [<video_name>_<frame_number>,
+            x_min,
+            y_min,
+            object width,
+            object height,
+            type of object,
+            distance of object,
+            type of motion of object]
+
+    Instead of formatting each entry separately in a Python loop, the column
+    arrays of each .mat file are zipped into rows and handed to
+    csv.writer.writerows, which does the value formatting in the C
+    implementation of the csv module. This way only the data of one .mat
+    file are held in memory at a time.
+
     Parameters
     ----------
     path : the path where the .mat files are located. (string)
+    save_path : the path of the csv file to save. (string)
     integer_bb : should the bounding box coordinates be integers? (boolean)
                         Default is False.
-                        
-    Returns
-    -------
-    object_list : list of csv entries. Each entry is of the form:
-            [<video_name>_<frame_number>, 
-            x_min, 
-            y_min, 
-            object width, 
-            object height, 
-            type of object, 
-            distance of object, 
-            type of motion of object]
     """
-    object_list = []
-    frames = load_mat_files_in_dict(path)
-    for key in frames.keys():
-        frame = frames[key]
-        
-        frame.generate_list_as_csv(integer_bb)
-        object_list_part = frame.get_list_as_csv()        
-            
-        # append part list of objects to full list of objects
-        object_list = object_list + object_list_part
-            
-        
-    print("Total objects in the dataset: ", len(object_list))
-    
-    return object_list
-            
+    total_objects = 0
 
-for i, file_path in enumerate(PATHS_TO_GT_FILES):
-    
-    frame_list = get_all_gt_files_in_csv(file_path, False)
-     
-    with open(PATHS_TO_SAVE_CSV_FILES[i], 'w') as f:
-        for item in frame_list:
-            f.write("%s\n" % item)
-     
\ No newline at end of file
+    # a large write buffer amortizes the write syscalls over many csv rows
+    with open(save_path, 'w', newline='', buffering=1<<20) as f:
+        # keep the unix line endings the file was always written with
+        writer = csv.writer(f, lineterminator='\n')
+        for columns in iter_mat_files_columns(path):
+            names = columns['image_name']
+            bb = columns['bb']
+            obj = columns['objects']
+            dist = columns['distance']
+            mot = columns['motion']
+
+            # avoid possible bad entries / there is one in MVI_1613_VIS_frame0.jpg
+            mask, bb_int = _filter_and_cast(bb, obj.astype(np.int64))
+
+            if integer_bb:
+                bb = bb_int
+
+            writer.writerows(zip(names[mask],
+                                 bb[mask,0], bb[mask,1],
+                                 bb[mask,2], bb[mask,3],
+                                 obj[mask], dist[mask], mot[mask]))
+            total_objects += int(mask.sum())
+
+    print("Total objects in the dataset: ", total_objects)
+
+
+def process_one_dataset(paths_pair):
+    """
+    Converts one dataset (NIR, VIS_Onshore or VIS_Onboard) into a csv file.
+
+    Parameters
+    ----------
+    paths_pair : tuple of the path of the .mat files of the dataset and the
+                    path of the csv file to save. (gt_path, save_path)
+    """
+    file_path, save_path = paths_pair
+    get_all_gt_files_in_csv(file_path, save_path, False)
+
+
+if __name__ == '__main__':
+    # the three datasets are independent of each other so they can be
+    # converted in parallel, one worker process per dataset
+    with ProcessPoolExecutor(max_workers=len(PATHS_TO_GT_FILES)) as executor:
+        list(executor.map(process_one_dataset,
+                          zip(PATHS_TO_GT_FILES, PATHS_TO_SAVE_CSV_FILES)))
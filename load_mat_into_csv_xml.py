@@ -29,34 +29,161 @@ python load_mat_into_csv_xml.py -i /home/tbontz2s/singapore_dataset -o /home/tbo
 
 from scipy.io import loadmat
 import os
-from os import listdir
-from os.path import isfile, join
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+import numpy as np
 import argparse
+from numba import njit
+
+from smd_gt_utils import generate_gt_files_dict
 
 
 GT_FILES_PATHS_LIST = ["NIR/ObjectGT", "VIS_Onshore/ObjectGT", "VIS_Onboard/ObjectGT"]
 
+@njit(cache=True)
+def _bb_kernel(bb, labels):
+    """
+    Jit compiled kernel for the integer bounding box conversion. Filters the
+    bad (zero label) entries and casts all box coordinates in one pass.
+
+    Parameters
+    ----------
+    bb : the bounding box coordinates of the objects of a frame, one
+            [x_min,y_min,width,height] line per object. (2D float array)
+    labels : the integer class labels of the objects. (1D int array)
+
+    Returns
+    -------
+    keep : boolean array which is True for the valid (non zero) objects.
+    xmin, ymin, xmax, ymax, w, h : the box coordinates as int32 arrays.
+    """
+    number_of_objects = bb.shape[0]
+    keep = np.empty(number_of_objects, dtype=np.bool_)
+    xmin = np.empty(number_of_objects, dtype=np.int32)
+    ymin = np.empty(number_of_objects, dtype=np.int32)
+    xmax = np.empty(number_of_objects, dtype=np.int32)
+    ymax = np.empty(number_of_objects, dtype=np.int32)
+    w = np.empty(number_of_objects, dtype=np.int32)
+    h = np.empty(number_of_objects, dtype=np.int32)
+    for i in range(number_of_objects):
+        keep[i] = labels[i] != 0
+        xmin[i] = int(bb[i, 0])
+        ymin[i] = int(bb[i, 1])
+        w[i] = int(bb[i, 2])
+        h[i] = int(bb[i, 3])
+        # cast the float sums so truncation matches int(x + w)
+        xmax[i] = int(bb[i, 0] + bb[i, 2])
+        ymax[i] = int(bb[i, 1] + bb[i, 3])
+    return keep, xmin, ymin, xmax, ymax, w, h
+
+# warm the jit cache once at import time so the compiled kernel is reused
+_bb_kernel(np.zeros((1, 4)), np.zeros(1, dtype=np.int64))
+
+
+# background pool for the xml file writes; writing releases the GIL so the
+# disk writes overlap with the .mat parsing and string building
+_XML_WRITER = ThreadPoolExecutor(max_workers=4)
+
+
+def _write_file(filename, data):
+    """
+    Writes data into filename. This is the work submitted to the background
+    xml writer pool.
+
+    Parameters
+    ----------
+    filename : the path of the file to write. (string)
+    data : the content to write. (string)
+    """
+    with open(filename, 'w', buffering=1<<20) as file:
+        file.write(data)
+
+
+# cache of the parsed structXML fields keyed by .mat file path so that each
+# ground truth file is parsed at most once per run
+_MAT_CACHE = {}
+
+
+def _load_structxml(path):
+    """
+    Loads the used structXML fields of a ground truth .mat file, parsing
+    each file at most once per run. Parsing the MATLAB format dominates the
+    loading cost, so repeated conversions of the same file (e.g. the csv
+    and the xml pass) hit the in-memory cache instead.
+
+    Parameters
+    ----------
+    path : the path of the .mat file. (string)
+
+    Returns
+    -------
+    (bbs, objs) : the per frame BB and Object field arrays of the
+        structXML structured array stored in the file.
+    """
+    fields = _MAT_CACHE.get(path)
+    if fields is None:
+        # only the structXML variable is used, skip decoding anything else
+        struct_xml = loadmat(path, variable_names=['structXML'])['structXML'][0]
+        fields = (struct_xml['BB'], struct_xml['Object'])
+        _MAT_CACHE[path] = fields
+    return fields
+
+# xml templates with the invariant skeleton built once at import time; the
+# converters only fill in the handful of variable fields per frame/object
+_HDR_TMPL = ("<annotation>\n<folder>{folder}</folder>\n"
+             "<filename>{filename}</filename>\n"
+             "<path>{path}</path>\n"
+             "<source>\n\t<database>Unknown</database>\n</source>\n"
+             "<size>\n"
+             "\t<width>1920</width>\n"
+             "\t<height>1080</height>\n"
+             "\t<depth>3</depth>\n"
+             "</size>\n"
+             "<segmented>Unspecified</segmented>\n")
+
+_OBJ_TMPL = ("<object>\n"
+             "\t<name>{name}</name>\n"
+             "\t<pose>Unspecified</pose>\n"
+             "\t<truncated>Unspecified</truncated>\n"
+             "\t<difficult>Unspecified</difficult>\n"
+             "\t<occluded>Unspecified</occluded>\n"
+             "\t<bndbox>\n"
+             "\t\t<xmin>{xmin}</xmin>\n"
+             "\t\t<xmax>{xmax}</xmax>\n"
+             "\t\t<ymin>{ymin}</ymin>\n"
+             "\t\t<ymax>{ymax}</ymax>\n"
+             "\t</bndbox>\n"
+             "</object>\n")
+
+# mapping of the integer class codes of the dataset to the class names
+_CLASSES = {
+        1:"Ferry",
+        2:"Buoy",
+        3:"Vessel/ship",
+        4:"Speed boat",
+        5:"Boat",
+        6:"Kayak",
+        7:"Sail boat",
+        8:"Swimming person",
+        9:"Flying bird/plane",
+        10:"Other"
+        }
+
+
 class Frame:
     """
     This is a class to save the data for each video frame
     """
-    csv_list = []
-    csv_list_initialized = False
-    classes_dict = {
-            1:"Ferry",
-            2:"Buoy",
-            3:"Vessel/ship",
-            4:"Speed boat",
-            5:"Boat",
-            6:"Kayak",
-            7:"Sail boat",
-            8:"Swimming person",
-            9:"Flying bird/plane",
-            10:"Other"
-            }
-    
-    def __init__(self, frame, image_name, bb, objects, motion, distance, image_path='', xml_path=''):
+    # one Frame instance is created per video frame, so slots save the per
+    # instance __dict__ and speed up the attribute accesses
+    __slots__ = ('frame', 'image_name', 'bb', 'objects',
+                 'image_path', 'xml_path', 'csv_list',
+                 'csv_list_initialized', 'xml', 'xml_initialized',
+                 '_stem', '_folder_name', '_prepared',
+                 '_prepared_integer_bb', '_labels', '_keep',
+                 '_xmin', '_ymin', '_xmax', '_ymax', '_w', '_h')
+
+    def __init__(self, frame, image_name, bb, objects, image_path='', xml_path=''):
         """
         Parameters
         ----------
@@ -67,8 +194,6 @@ class Frame:
                 [x_min,y_min,width,height]. See the dataset webpage for more
                 info.
             objects : the type of objects. (array)
-            motion : of the objects are moving or not. (array)
-            distance : distance of each objects. (array)
             image_path : path of the file (without the filename). (string)
             xml_path : path to save the generated xml file. (string)
             
@@ -77,12 +202,68 @@ class Frame:
         self.image_name = image_name
         self.bb = bb
         self.objects = objects
-        self.motion = motion
-        self.distance = distance
         self.image_path = image_path
         self.xml_path = xml_path
         self.csv_list_initialized = False
         self.xml_initialized = False
+        self._prepared = False
+        self._prepared_integer_bb = False
+        # precompute the path pieces needed by the xml generation so the
+        # hot converters do not re-parse strings per call
+        self._stem = os.path.splitext(image_name)[0]
+        self._folder_name = os.path.basename(image_path)
+
+    def _prepare(self, integer_bb=False):
+        """
+        Computes the labels, the keep mask and the box corners of the frame
+        once and caches them on the instance, so the csv and the xml
+        converters share the same arithmetic instead of repeating it.
+
+        Parameters
+        ----------
+        integer_bb : should the bounding box coordinates be integers? (boolean)
+                        Default is False.
+        """
+        if self._prepared and self._prepared_integer_bb == integer_bb:
+            return
+
+        self._labels = None
+        self._keep = None
+
+        # objects is a list in a list. To avoid problems with " len([[]]) -> 1 " that sanity chack should be used.
+        if len(self.objects[0]) > 0:
+            labels = np.asarray(self.objects)[:,0]
+            bb = np.asarray(self.bb)
+
+            # the filtering below also avoids possible bad entries / there
+            # is one in MVI_1613_VIS_frame0.jpg
+            if integer_bb:
+                # the jit compiled kernel filters and casts in one pass
+                keep, xmin, ymin, xmax, ymax, w, h = _bb_kernel(
+                        bb, labels.astype(np.int64))
+            else:
+                keep = labels.astype(np.int64) != 0
+
+                # compute the box corners for all objects at once instead
+                # of per object scalar arithmetic in a Python loop
+                xmin = bb[:,0]
+                ymin = bb[:,1]
+                w = bb[:,2]
+                h = bb[:,3]
+                xmax = xmin + w
+                ymax = ymin + h
+
+            self._labels = labels
+            self._keep = keep
+            self._xmin = xmin
+            self._ymin = ymin
+            self._xmax = xmax
+            self._ymax = ymax
+            self._w = w
+            self._h = h
+
+        self._prepared = True
+        self._prepared_integer_bb = integer_bb
         
     def convert_frame_to_csv(self, integer_bb=False):
         """
@@ -105,36 +286,20 @@ class Frame:
         integer_bb : should the bounding box coordinates be integers? (boolean)
                         Default is False.
         """
+        self._prepare(integer_bb)
         self.csv_list = []
-        number_of_objects = len(self.objects) # get the total number of objects
-        
-        # objects is a list in a list. To avoid problems with " len([[]]) -> 1 " that sanity chack should be used.
-        if len(self.objects[0]) > 0:
-            for i in range(number_of_objects):
-                # avoid possible bad entries / there is one in MVI_1613_VIS_frame0.jpg
-                if (int(self.objects[i][0])) != 0:
-                    if integer_bb:
-                        entry = (self.image_name,
-                                    int(self.bb[i,2]),
-                                    int(self.bb[i,3]),
-                                    self.objects[i][0],
-                                    int(self.bb[i,0]),
-                                    int(self.bb[i,1]),
-                                    int(self.bb[i,0] + self.bb[i,2]),
-                                    int(self.bb[i,1] + self.bb[i,3])
-                                )
-                    else:
-                        entry = (self.image_name,
-                                    self.bb[i,2],
-                                    self.bb[i,3],
-                                    self.objects[i][0],
-                                    self.bb[i,0],
-                                    self.bb[i,1],
-                                    self.bb[i,0] + self.bb[i,2],
-                                    self.bb[i,1] + self.bb[i,3]
-                                )
-                    self.csv_list.append(entry)
-            
+
+        if self._labels is not None:
+            keep = self._keep
+            self.csv_list = list(zip([self.image_name] * int(keep.sum()),
+                                     self._w[keep].tolist(),
+                                     self._h[keep].tolist(),
+                                     self._labels[keep].tolist(),
+                                     self._xmin[keep].tolist(),
+                                     self._ymin[keep].tolist(),
+                                     self._xmax[keep].tolist(),
+                                     self._ymax[keep].tolist()))
+
         self.csv_list_initialized = True
         
     def convert_frame_to_VOC_xml(self, integer_bb=False):
@@ -152,89 +317,48 @@ class Frame:
         -------
         xml : the corresponding VOC XML representation of the frame data. (string)
         """
-        folder_name = self.image_path.split('/')[-1]
-        file_path = os.path.join(self.image_path, self.image_name)
-        xml = ''
-        
-        xml = "<annotation>\n<folder>" + folder_name + "</folder>\n"
-        xml = xml + "<filename>" + self.image_name +"</filename>\n"
-        xml = xml + "<path>" + file_path +"</path>\n"
-        xml = xml + "<source>\n\t<database>Unknown</database>\n</source>\n"
-        xml = xml + "<size>\n"
-        xml = xml +     "\t<width>" + str(1920) + "</width>\n"
-        xml = xml +    "\t<height>" + str(1080) + "</height>\n"
-        xml = xml +    "\t<depth>"+str(3)+"</depth>\n"
-        xml = xml +  "</size>\n"
-        xml = xml + "<segmented>Unspecified</segmented>\n"
-        
-        
-        number_of_objects = len(self.objects) # get the total number of objects
-        
-        # objects is a list in a list. To avoid problems with " len([[]]) -> 1 " that sanity chack should be used.
-        if len(self.objects[0]) > 0:
-            for i in range(number_of_objects):
-                # avoid possible bad entries / there is one in MVI_1613_VIS_frame0.jpg
-                if (int(self.objects[i][0])) != 0:
-                    xml = xml  + self._get_xml_for_bbx(self.objects[i][0], self.bb[i,:], integer_bb)
-                    
-        xml = xml + "</annotation>"
-        
-        self.xml = xml
+        # collect the xml pieces in a list and join them once at the end;
+        # rebuilding the string with + for every piece is quadratic in the
+        # size of the document
+        parts = [_HDR_TMPL.format(
+                folder=self._folder_name,
+                filename=self.image_name,
+                path=os.path.join(self.image_path, self.image_name))]
+
+        self._prepare(integer_bb)
+
+        if self._labels is not None:
+            for i in np.nonzero(self._keep)[0]:
+                parts.append(self._get_xml_for_bbx(
+                        self._labels[i], self._xmin[i], self._xmax[i],
+                        self._ymin[i], self._ymax[i]))
+
+        parts.append("</annotation>")
+
+        self.xml = ''.join(parts)
         
         
-    def _get_xml_for_bbx(self, label, bb_data, integer_bb=False):
+    def _get_xml_for_bbx(self, label, xmin, xmax, ymin, ymax):
         """
         Creates the VOC XML representation for an object in an image.
         Code based on:
         https://dataturks.com/help/ibbx_dataturks_to_pascal_voc_format.php
-        
+
         Parameters
         ----------
         label : the integer label corresponding to the object class. (int)
-        
-        bb_data : the bounding box data in the list format:
-            [xmin, ymin, width, height]
-            
-        integer_bb : should the bounding box coordinates be integers? (boolean)
-                        Default is False.
-        
+
+        xmin, xmax, ymin, ymax : the box corners precomputed by _prepare.
+
         Returns
         -------
         xml : the corresponding object entry in xml value. (string)
         """
-        xmin = bb_data[0]
-        xmax = bb_data[0] + bb_data[2]
-        ymin = bb_data[1]
-        ymax = bb_data[1] + bb_data[3]
-        
-        if integer_bb:
-            xmin = int(xmin)
-            xmax = int(xmax)
-            ymin = int(ymin)
-            ymax = int(ymax)
-        
-        xml = "<object>\n"
-        xml = xml + "\t<name>" + str(self._convert_class_int_to_string(label)) + "</name>\n"
-        xml = xml + "\t<pose>Unspecified</pose>\n"
-        xml = xml + "\t<truncated>Unspecified</truncated>\n"
-        xml = xml + "\t<difficult>Unspecified</difficult>\n"
-        xml = xml + "\t<occluded>Unspecified</occluded>\n"
-        xml = xml + "\t<bndbox>\n"
-        xml = xml +     "\t\t<xmin>" + str(xmin) + "</xmin>\n"
-        xml = xml +     "\t\t<xmax>" + str(xmax) + "</xmax>\n"
-        xml = xml +     "\t\t<ymin>" + str(ymin) + "</ymin>\n"
-        xml = xml +     "\t\t<ymax>" + str(ymax) + "</ymax>\n"
-        xml = xml + "\t</bndbox>\n"
-        xml = xml + "</object>\n"
-        
-        return xml
-    
-    def _convert_class_int_to_string(self, class_int):
-        """
-        TODO: write
-        """
-        return self.classes_dict[class_int]
-            
+        return _OBJ_TMPL.format(
+                name=_CLASSES[int(label)],
+                xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
+
+
     def get_frame_as_csv(self):
         if not self.csv_list_initialized:
             self.convert_frame_to_csv() # create list with float bb
@@ -244,46 +368,32 @@ class Frame:
         """
         Saves the frame in the VOC xml represenation in the specified path set
         in the constructor.
-        
+
         Skips the generation if image or xml path are empty.
+
+        Returns
+        -------
+        future : the pending write handed to the background pool, or None if
+            the generation was skipped. The caller must check its result so
+            failed writes are not silently dropped.
         """
         if not self.image_path.strip():
             print('There was no valid path set for the image. Skipping xml generation.')
-            return
-        
+            return None
+
         if not self.xml_path.strip():
             print('There was no valid path set for the xml. Skipping xml generation.')
-            return
-        
+            return None
+
         if not self.xml_initialized:
             self.convert_frame_to_VOC_xml()
+
+        filename = os.path.join(self.xml_path, self._stem + '.xml')
+        # hand the write over to the background pool so it overlaps with the
+        # processing of the next frames
+        return _XML_WRITER.submit(_write_file, filename, self.xml)
             
-        filename = os.path.join(self.xml_path, self.image_name.split('.')[0] + '.xml')
-        with open(filename, 'w') as file:
-            file.write(self.xml)
-            
-    
-def generate_gt_files_dict(path_to_gt_files):
-    """
-    Creates a dictionary with all the ground truth files location.
-    
-    Parameters
-    ----------
-    path_to_gt_files : the path to the ground truth files. (string)
     
-    Returns
-    -------
-    object_gt_files_dict : dictionary in the form:
-        (key:value) -> (<video_name>:<video_path>)
-    """
-    object_gt_files_dict = {}
-    for f in listdir(path_to_gt_files):
-        if isfile(join(path_to_gt_files, f)):
-            object_gt_files_dict[f.split('.')[0].replace('_ObjectGT','')] = join(path_to_gt_files, f)
-        
-    return object_gt_files_dict
-    
-
 def load_mat_files_in_dict(path):
     """
     Loads all the .mat files of the Singapore Maritime Dataset. It converts
@@ -301,25 +411,22 @@ def load_mat_files_in_dict(path):
     """
     frames = {}
     object_gt_files_dict = generate_gt_files_dict(path)
-    
-    for key in object_gt_files_dict.keys():
-        file_name = object_gt_files_dict[key]
-        
-        gt = loadmat(file_name)
-        
+
+    for file_name in object_gt_files_dict.values():
+        bbs, objs = _load_structxml(file_name)
+
         # get the number of frames
-        frames_number = len(gt['structXML'][0])
-        
+        frames_number = len(bbs)
+
+        # hoist the video prefix out of the frame loop, it is constant per file
+        video_prefix = os.path.splitext(os.path.basename(file_name))[0].replace('_ObjectGT','')
+
         # process data for each frame
         for i in range(frames_number):
-            image_name = file_name.split('/')[-1].replace('_ObjectGT.mat','') + ('_frame%d.jpg' % i)
-            bb = gt['structXML'][0]['BB'][i]
-            objects = gt['structXML'][0]['Object'][i]
-            motion = gt['structXML'][0]['Motion'][i]
-            distance = gt['structXML'][0]['Distance'][i]
-            frame = Frame(i, image_name, bb, objects, motion, distance)
+            image_name = f'{video_prefix}_frame{i}.jpg'
+            frame = Frame(i, image_name, bbs[i], objs[i])
             frames[image_name] = frame
-        
+
     return frames
 
     
@@ -349,14 +456,11 @@ def get_all_gt_files_in_csv(path, integer_bb=False):
     """
     object_list = []
     frames = load_mat_files_in_dict(path)
-    for key in frames.keys():
-        frame = frames[key]
-        
+    for frame in frames.values():
         frame.convert_frame_to_csv(integer_bb)
-        object_list_part = frame.get_frame_as_csv()        
-            
+
         # append part list of objects to full list of objects
-        object_list = object_list + object_list_part
+        object_list.extend(frame.csv_list)
             
         
     print("Total objects in the dataset: ", len(object_list)) # TODO: maybe remove or rephrase?
@@ -400,21 +504,15 @@ def get_gt_files_in_csv(path, frames_tuple, integer_bb=False):
     object_list_train = []
     object_list_test = []
     frames = load_mat_files_in_dict(path)
-    for key in frames.keys():
+    for key, frame in frames.items():
         if key in train_frames:
-            frame = frames[key]
-            
             frame.convert_frame_to_csv(integer_bb)
-            object_list_part = frame.get_frame_as_csv()        
-            
-            object_list_train = object_list_train + object_list_part
+
+            object_list_train.extend(frame.csv_list)
         elif key in test_frames:
-            frame = frames[key]
-            
             frame.convert_frame_to_csv(integer_bb)
-            object_list_part = frame.get_frame_as_csv()        
-            
-            object_list_test = object_list_test + object_list_part
+
+            object_list_test.extend(frame.csv_list)
             
             
         
@@ -435,31 +533,36 @@ def get_generated_frames_dict(paths):
     
     Returns
     -------
-    
-    tuple of train frames and test frames list
+
+    tuple of train frames and test frames frozensets
     '''
     train_path, test_path = paths
-    
-    train_frames = [frame for frame in os.listdir(train_path)
-                                if isfile(os.path.join(train_path, frame))]
-    
-    test_frames = [frame for frame in os.listdir(test_path)
-                                if isfile(os.path.join(test_path, frame))]
 
+    # frozensets make the per frame membership tests O(1) instead of a
+    # linear scan over tens of thousands of file names; scandir exposes
+    # is_file() from the cached directory entry so no extra stat call is
+    # needed per frame as with listdir + isfile
+    with os.scandir(train_path) as entries:
+        train_frames = frozenset(entry.name for entry in entries
+                                    if entry.is_file())
+
+    with os.scandir(test_path) as entries:
+        test_frames = frozenset(entry.name for entry in entries
+                                    if entry.is_file())
 
     return (train_frames, test_frames)
     
         
 def generate_split_dataset_csv_xml(path, frames_tuple, paths_list, integer_bb=False):
     """
-    Loads all the .mat files of the Singapore Maritime Dataset. 
-    It loads the .mat data for each frame included into the train/test dataset 
-    and converts it into a Frame class instance. 
-    Each frame is added in a "frames" dictionary as a Frame object.
-    Each Frame object data is also converted into CSV format and added into the 
+    Loads all the .mat files of the Singapore Maritime Dataset.
+    It loads the .mat data for each frame included into the train/test dataset
+    and converts it into a Frame class instance.
+    Each Frame object data is converted into CSV format and added into the
     corresponding list of train/test frames.
-    The code also invokes the generation and file write of the VOC XML files 
-    for each Frame instance.
+    The code also invokes the generation and file write of the VOC XML files
+    for each Frame instance. The Frame instances are dropped as soon as they
+    are converted, only the csv rows are accumulated.
     
     Parameters
     ----------
@@ -476,9 +579,6 @@ def generate_split_dataset_csv_xml(path, frames_tuple, paths_list, integer_bb=Fa
     
     Returns
     -------
-    frames : a dictionary of the form:
-            (key:value) -> (<video_name>_<frame_number>:<Frame class instance>)
-            
     object_list_train : list with objects in the train frames.
     
             This is a list of csv entries. Each entry is of the form:
@@ -503,116 +603,191 @@ def generate_split_dataset_csv_xml(path, frames_tuple, paths_list, integer_bb=Fa
                     'xmax', 
                     'ymax')
     """
+    object_list_train = []
+    object_list_test = []
+    object_gt_files_dict = generate_gt_files_dict(path)
+
+    _init_split_worker(frames_tuple, paths_list)
+    for file_name in object_gt_files_dict.values():
+        train_part, test_part = _process_one_mat((file_name, integer_bb))
+        object_list_train.extend(train_part)
+        object_list_test.extend(test_part)
+
+    return object_list_train, object_list_test
+
+
+# per process split context set once by the pool initializer; the train and
+# test frame name sets hold tens of thousands of entries, so shipping them
+# with every task would pickle them once per .mat file
+_SPLIT_CONTEXT = None
+
+
+def _init_split_worker(frames_tuple, paths_list):
+    """
+    Initializer of the split conversion workers. Stores the train/test
+    frame name sets and the output paths in the worker process once, so
+    the tasks only need to carry the .mat file path.
+
+    Parameters
+    ----------
+    frames_tuple : tuple of frames names for train and test.
+                    (train_frames, test_frames)
+
+    paths_list : list of the paths for images and annotations.
+        [images_train_path, images_test_path, xml_annotations_train_path, xml_annotations_test_path]
+    """
+    global _SPLIT_CONTEXT
+    _SPLIT_CONTEXT = (frames_tuple, paths_list)
+
+
+def _process_one_mat(task):
+    """
+    Processes one ground truth .mat file for the train/test split: creates
+    the Frame instances of its frames, converts them into CSV format and
+    writes their VOC XML files. The .mat files are independent of each
+    other, so this is the unit of work handed to the worker processes. The
+    frame name sets and output paths are read from the split context set
+    up by _init_split_worker.
+
+    Parameters
+    ----------
+    task : tuple of the form (file_name, integer_bb) where file_name is
+        the path of a single .mat file.
+
+    Returns
+    -------
+    Tuple (object_list_train, object_list_test) for the file.
+    """
+    file_name, integer_bb = task
+    frames_tuple, paths_list = _SPLIT_CONTEXT
     train_frames, test_frames = frames_tuple
     images_train_path, images_test_path, xml_annotations_train_path, xml_annotations_test_path = paths_list
-    frames = {}
     object_list_train = []
     object_list_test = []
-    object_gt_files_dict = generate_gt_files_dict(path)
-    
-    for key in object_gt_files_dict.keys():
-        file_name = object_gt_files_dict[key]
-        
-        gt = loadmat(file_name)
-        
-        # get the number of frames
-        frames_number = len(gt['structXML'][0])
-        
-        # process data for each frame
-        for i in range(frames_number):
-            image_name = file_name.split('/')[-1].replace('_ObjectGT.mat','') + ('_frame%d.jpg' % i)
-            
-            if image_name in train_frames:
-                bb = gt['structXML'][0]['BB'][i]
-                objects = gt['structXML'][0]['Object'][i]
-                motion = gt['structXML'][0]['Motion'][i]
-                distance = gt['structXML'][0]['Distance'][i]
-                frame = Frame(i, image_name, bb, objects, motion, distance, images_train_path, xml_annotations_train_path)
-                frames[image_name] = frame
-                object_list_part = frame.get_frame_as_csv()
-                object_list_train = object_list_train + object_list_part
-                frame.save_frame_as_xml()
-                
-            elif image_name in test_frames:
-                bb = gt['structXML'][0]['BB'][i]
-                objects = gt['structXML'][0]['Object'][i]
-                motion = gt['structXML'][0]['Motion'][i]
-                distance = gt['structXML'][0]['Distance'][i]
-                frame = Frame(i, image_name, bb, objects, motion, distance, images_test_path, xml_annotations_test_path)
-                frames[image_name] = frame
-                object_list_part = frame.get_frame_as_csv()
-                object_list_test = object_list_test + object_list_part
-                frame.save_frame_as_xml()
-        
-    return frames, object_list_train, object_list_test
+    xml_futures = []
+
+    bbs, objs = _load_structxml(file_name)
+
+    # get the number of frames
+    frames_number = len(bbs)
+
+    # hoist the video prefix out of the frame loop, it is constant per file
+    video_prefix = os.path.splitext(os.path.basename(file_name))[0].replace('_ObjectGT','')
+
+    # process data for each frame
+    for i in range(frames_number):
+        image_name = f'{video_prefix}_frame{i}.jpg'
+
+        # the Frame instances only live until their csv rows and xml file
+        # are produced, so the memory use stays constant per .mat file
+        if image_name in train_frames:
+            frame = Frame(i, image_name, bbs[i], objs[i], images_train_path, xml_annotations_train_path)
+            object_list_part = frame.get_frame_as_csv()
+            object_list_train.extend(object_list_part)
+            xml_futures.append(frame.save_frame_as_xml())
+
+        elif image_name in test_frames:
+            frame = Frame(i, image_name, bbs[i], objs[i], images_test_path, xml_annotations_test_path)
+            object_list_part = frame.get_frame_as_csv()
+            object_list_test.extend(object_list_part)
+            xml_futures.append(frame.save_frame_as_xml())
+
+    # wait for the pending xml writes of this file and surface any write
+    # error (e.g. an unwritable annotations folder) instead of dropping it
+    for future in xml_futures:
+        if future is not None:
+            future.result()
+
+    return object_list_train, object_list_test
 
    
 
-# Initiate argument parser
-parser = argparse.ArgumentParser(
-    description="Sample TensorFlow SMD MAT-to-CSV-XML converter")
-parser.add_argument("-i",
-                    "--inputDir",
-                    help="Path to the folder where the unziped GT files are stored",
-                    type=str)
-parser.add_argument("-o",
-                    "--outputDir",
-                    help="Name of output directory", type=str)
-parser.add_argument("-f",
-                    "--framesDir",
-                    help="Directory that has the train and test folder with the frames", type=str)
-args = parser.parse_args()
-
-if(args.inputDir is None):
-    args.inputDir = os.getcwd()
-if(args.outputDir is None):
-    args.outputDir = args.inputDir# + "/labels.csv"
-if(args.framesDir is None):
-    args.framesDir = os.getcwd()
-
-assert(os.path.isdir(args.inputDir))
-assert(os.path.isdir(args.outputDir))
-assert(os.path.isdir(args.framesDir))
-
-images_train_path = os.path.join(args.framesDir, 'train')
-images_test_path = os.path.join(args.framesDir, 'test')
-xml_annotations_train_path = os.path.join(args.framesDir, 'train_annotations')
-xml_annotations_test_path = os.path.join(args.framesDir, 'test_annotations')
-
-# generate the xml folders if they are not there
-if not os.path.isdir(xml_annotations_train_path):
-    os.mkdir(xml_annotations_train_path)
-if not os.path.isdir(xml_annotations_test_path):
-    os.mkdir(xml_annotations_test_path)
-
-
-train_frames, test_frames =get_generated_frames_dict(
-                        [os.path.join(args.framesDir, 'train'),
-                         os.path.join(args.framesDir, 'test')])
-
-# generate tuple of frames and list of paths
-frames_tuple = (train_frames, test_frames)
-paths_list = [images_train_path, images_test_path, xml_annotations_train_path, xml_annotations_test_path]
-
-
-objects_list_train = []
-objects_list_test = []
-for mat_file in GT_FILES_PATHS_LIST:
-    _, object_list_train_temp, object_list_test_temp = generate_split_dataset_csv_xml(os.path.join(args.inputDir, mat_file), frames_tuple, paths_list, integer_bb=False)
-    #_, object_list_train_temp, object_list_test_temp = get_gt_files_in_csv(
-    #        os.path.join(args.inputDir, mat_file), (train_frames, test_frames), False)
-    objects_list_train = objects_list_train + object_list_train_temp
-    objects_list_test = objects_list_test + object_list_test_temp
-    
-print('Total objects in train dataset: ', len(objects_list_train))
-print('Total objects in test dataset: ', len(objects_list_test))
+def main():
+    # Initiate argument parser
+    parser = argparse.ArgumentParser(
+        description="Sample TensorFlow SMD MAT-to-CSV-XML converter")
+    parser.add_argument("-i",
+                        "--inputDir",
+                        help="Path to the folder where the unziped GT files are stored",
+                        type=str)
+    parser.add_argument("-o",
+                        "--outputDir",
+                        help="Name of output directory", type=str)
+    parser.add_argument("-f",
+                        "--framesDir",
+                        help="Directory that has the train and test folder with the frames", type=str)
+    args = parser.parse_args()
+
+    if(args.inputDir is None):
+        args.inputDir = os.getcwd()
+    if(args.outputDir is None):
+        args.outputDir = args.inputDir# + "/labels.csv"
+    if(args.framesDir is None):
+        args.framesDir = os.getcwd()
+
+    assert(os.path.isdir(args.inputDir))
+    assert(os.path.isdir(args.outputDir))
+    assert(os.path.isdir(args.framesDir))
+
+    images_train_path = os.path.join(args.framesDir, 'train')
+    images_test_path = os.path.join(args.framesDir, 'test')
+    xml_annotations_train_path = os.path.join(args.framesDir, 'train_annotations')
+    xml_annotations_test_path = os.path.join(args.framesDir, 'test_annotations')
+
+    # generate the xml folders if they are not there
+    if not os.path.isdir(xml_annotations_train_path):
+        os.mkdir(xml_annotations_train_path)
+    if not os.path.isdir(xml_annotations_test_path):
+        os.mkdir(xml_annotations_test_path)
+
+
+    train_frames, test_frames =get_generated_frames_dict(
+                            [os.path.join(args.framesDir, 'train'),
+                             os.path.join(args.framesDir, 'test')])
+
+    # generate tuple of frames and list of paths
+    frames_tuple = (train_frames, test_frames)
+    paths_list = [images_train_path, images_test_path, xml_annotations_train_path, xml_annotations_test_path]
+
+    # the .mat files are independent of each other, so build one flat task
+    # list over all three datasets and process it with a pool of workers;
+    # the frame name sets and paths go to each worker once via the
+    # initializer instead of being pickled into every task
+    tasks = []
+    for mat_file in GT_FILES_PATHS_LIST:
+        object_gt_files_dict = generate_gt_files_dict(os.path.join(args.inputDir, mat_file))
+        for file_name in object_gt_files_dict.values():
+            tasks.append((file_name, False))
+
+    column_name = ['filename', 'width', 'height',
+                    'class', 'xmin', 'ymin', 'xmax', 'ymax']
+
+    total_objects_train = 0
+    total_objects_test = 0
+
+    # stream the csv rows to the output files as the worker results arrive
+    # instead of piling every object row into memory and building a
+    # DataFrame at the end; csv.writer formats the values in C
+    with open(args.outputDir + '/train_labels.csv', 'w', newline='', buffering=1<<20) as train_file, \
+         open(args.outputDir + '/test_labels.csv', 'w', newline='', buffering=1<<20) as test_file:
+        train_writer = csv.writer(train_file, lineterminator='\n')
+        test_writer = csv.writer(test_file, lineterminator='\n')
+        train_writer.writerow(column_name)
+        test_writer.writerow(column_name)
+
+        with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                 initializer=_init_split_worker,
+                                 initargs=(frames_tuple, paths_list)) as executor:
+            for object_list_train_temp, object_list_test_temp in executor.map(_process_one_mat, tasks):
+                train_writer.writerows(object_list_train_temp)
+                test_writer.writerows(object_list_test_temp)
+                total_objects_train += len(object_list_train_temp)
+                total_objects_test += len(object_list_test_temp)
 
-column_name = ['filename', 'width', 'height',
-                'class', 'xmin', 'ymin', 'xmax', 'ymax']
+    print('Total objects in train dataset: ', total_objects_train)
+    print('Total objects in test dataset: ', total_objects_test)
+    print('Successfully converted mat to csv.')
 
-objects_train_df = pd.DataFrame(objects_list_train, columns=column_name)
-objects_test_df = pd.DataFrame(objects_list_test, columns=column_name)
 
-objects_train_df.to_csv(args.outputDir + '/train_labels.csv', index=None)
-objects_test_df.to_csv(args.outputDir + '/test_labels.csv', index=None)
-print('Successfully converted mat to csv.')
+if __name__ == '__main__':
+    main()
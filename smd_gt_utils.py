@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helper functions shared between the Singapore Maritime Dataset (SMD) ground
+truth conversion scripts (convert_mat_to_csv_LEGACY.py and
+load_mat_into_csv_xml.py). Before this module the scripts carried their own
+identical copies of these helpers.
+
+Dataset available here: https://sites.google.com/site/dilipprasad/home/singapore-maritime-dataset
+
+If this dataset is used please cite it as:
+
+D. K. Prasad, D. Rajan, L. Rachmawati, E. Rajabaly, and C. Quek,
+"Video Processing from Electro-optical Sensors for Object Detection and
+Tracking in Maritime Environment: A Survey," IEEE Transactions on Intelligent
+Transportation Systems (IEEE), 2017.
+"""
+
+from os import scandir
+
+
+def generate_gt_files_dict(path_to_gt_files):
+    """
+    Creates a dictionary with all the ground truth files location.
+
+    Parameters
+    ----------
+    path_to_gt_files : the path to the ground truth files. (string)
+
+    Returns
+    -------
+    object_gt_files_dict : dictionary in the form:
+        (key:value) -> (<video_name>:<video_path>)
+    """
+    # scandir exposes is_file() from the cached directory entry so no extra
+    # stat call is needed per file as with listdir + isfile
+    with scandir(path_to_gt_files) as entries:
+        object_gt_files_dict = {
+                entry.name.split('.')[0].replace('_ObjectGT',''): entry.path
+                for entry in entries if entry.is_file()}
+
+    return object_gt_files_dict